@@ -0,0 +1,109 @@
+"""doc_compiler のコンパイル時間を大きな入力で計測する。
+
+    python benchmarks/compile_docs.py --sections 500 5000 50000
+    python benchmarks/compile_docs.py --check-only
+
+計測の前に、生成したリクエストを UTF-16 単位の文書モデルに適用し、
+新規作成・追記の両方で段落スタイルの範囲が正しい段落に当たるかを確認する。
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from doc_compiler import (  # noqa: E402
+    BODY_STYLE, HEADING_STYLE, TITLE_STYLE, append_start, compile_document, split_batches, split_runs, utf16_len
+)
+
+
+def make_contents(sections):
+    # BMP 外の文字を混ぜて UTF-16 の長さ計算も負荷に含める
+    return [
+        {"heading": f"見出し {i} 📊", "body": f"本文 {i} " + "テキスト😀 " * 40}
+        for i in range(sections)
+    ]
+
+
+def apply_requests(text, requests_list):
+    """insertText を適用した本文（UTF-16 コード単位の列）と、単位ごとの段落スタイルを返す。
+
+    text は既存の本文で、Docs と同じくインデックス 1 から始まり末尾は改行。
+    """
+    units = text.encode('utf-16-le')
+    styles = {}
+    for request in requests_list:
+        if 'insertText' in request:
+            offset = (request['insertText']['location']['index'] - 1) * 2
+            units = units[:offset] + request['insertText']['text'].encode('utf-16-le') + units[offset:]
+        else:
+            update = request['updateParagraphStyle']
+            for index in range(update['range']['startIndex'], update['range']['endIndex']):
+                styles[index] = update['paragraphStyle']['namedStyleType']
+    return units, styles
+
+
+def check_document(existing, contents, title):
+    """existing（None なら新規文書）に contents を書き込み、各段落のスタイルを検証する。"""
+    text = existing or '\n'
+    if existing is None:
+        start_index, append = 1, False
+    else:
+        start_index, append = append_start({"body": {"content": [{"endIndex": utf16_len(text) + 1}]}})
+    units, styles = apply_requests(text, compile_document(contents, title=title, start_index=start_index, append=append))
+
+    expected = [(title, TITLE_STYLE)]
+    for content in contents:
+        expected += [(content['heading'], HEADING_STYLE), (content['body'], BODY_STYLE)]
+
+    index = utf16_len(existing) + 1 if append else 1
+    for paragraph, style in expected:
+        encoded = (paragraph + '\n').encode('utf-16-le')
+        offset = (index - 1) * 2
+        assert units[offset:offset + len(encoded)] == encoded, f"text mismatch at {index}: {paragraph!r}"
+        for unit_index in range(index, index + len(encoded) // 2):
+            # 新規文書では本文は既定の標準テキストのままで範囲を持たない
+            assert styles.get(unit_index, BODY_STYLE) == style, f"{paragraph!r} at {unit_index} is not {style}"
+        index += len(encoded) // 2
+
+
+def check():
+    contents = [
+        {"heading": "見出し 📊", "body": "本文😀😀"},
+        {"heading": "", "body": ""},
+        {"heading": "𠮷野家", "body": "末尾"},
+    ]
+    check_document(None, contents, "タイトル😀")
+    # 見出しで終わる既存文書に追記しても、本文が見出しにならないこと
+    check_document("既存の見出し😀\n", contents, "追記")
+    assert split_runs([("😀" * 7, 14)], 6) == ["😀😀😀", "😀😀😀", "😀"]
+    print("doc_compiler checks passed")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sections", type=int, nargs="+", default=[500, 5000, 50000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--check-only", action="store_true")
+    args = parser.parse_args()
+
+    check()
+    if args.check_only:
+        return
+
+    for sections in args.sections:
+        contents = make_contents(sections)
+        compile_times = timeit.repeat(
+            lambda: compile_document(contents, title="ベンチマーク"), number=1, repeat=args.repeat
+        )
+        requests_list = compile_document(contents, title="ベンチマーク")
+        split_times = timeit.repeat(lambda: split_batches(requests_list), number=1, repeat=args.repeat)
+        batches = split_batches(requests_list)
+        print(f"{sections:>6} sections: compile {min(compile_times) * 1000:8.2f} ms, "
+              f"split {min(split_times) * 1000:8.2f} ms, "
+              f"{len(requests_list)} requests in {len(batches)} batchUpdate calls")
+
+
+if __name__ == "__main__":
+    main()
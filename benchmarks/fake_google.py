@@ -0,0 +1,311 @@
+"""trigger() が使う Sheets / Drive / Docs / Slack webhook を真似るローカルサーバー。
+
+    python benchmarks/fake_google.py --port 8081 --latency-ms 80 --error-rate 0.02
+
+main.py を GOOGLE_API_ROOT=http://127.0.0.1:8081/ 、SLACK_WEBHOOK_URL=http://127.0.0.1:8081/slack/webhook
+で起動し、認証情報の token_uri を http://127.0.0.1:8081/token に向けると、Google アカウントに触れずに動かせる。
+GET /_stats で API ごとの呼び出し数、POST /_reset でカウンタの初期化。
+"""
+import argparse
+import email
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+ROUTE_PARAM = re.compile(r'\(\?P<(\w+)>[^)]*\)')
+
+THROTTLE_BODY = {
+    "error": {
+        "code": 429,
+        "message": "Quota exceeded (fake server).",
+        "status": "RESOURCE_EXHAUSTED",
+        "errors": [{"reason": "rateLimitExceeded", "message": "Quota exceeded (fake server)."}]
+    }
+}
+
+NOT_FOUND_BODY = {"error": {"code": 404, "message": "File not found (fake server).", "status": "NOT_FOUND"}}
+
+
+def utf16_len(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+class FakeGoogle:
+    """ファイルの状態と呼び出し数を持ち、各エンドポイントの応答を組み立てる。"""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0, quota_per_minute=0, retry_after=1):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.quota_per_minute = quota_per_minute
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.files = {}
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.windows = {}
+        routes = [
+            ('POST', r'/token', 'auth', self.token),
+            ('POST', r'/drive/v3/files', 'drive', self.create_file),
+            ('GET', r'/drive/v3/files/(?P<id>[^/]+)', 'drive', self.get_file),
+            ('PATCH', r'/drive/v3/files/(?P<id>[^/]+)', 'drive', self.update_file),
+            ('DELETE', r'/drive/v3/files/(?P<id>[^/]+)', 'drive', self.delete_file),
+            ('POST', r'/drive/v3/files/(?P<id>[^/]+)/permissions', 'drive', self.create_permission),
+            ('GET', r'/v4/spreadsheets/(?P<id>[^/:]+)', 'sheets', self.get_spreadsheet),
+            ('POST', r'/v4/spreadsheets/(?P<id>[^/:]+):batchUpdate', 'sheets', self.spreadsheet_batch_update),
+            ('POST', r'/v4/spreadsheets/(?P<id>[^/:]+)/values:batchUpdate', 'sheets', self.values_batch_update),
+            ('POST', r'/v1/documents', 'docs', self.create_document),
+            ('GET', r'/v1/documents/(?P<id>[^/:]+)', 'docs', self.get_document),
+            ('POST', r'/v1/documents/(?P<id>[^/:]+):batchUpdate', 'docs', self.document_batch_update),
+            ('POST', r'/slack/.*', 'slack', self.slack),
+        ]
+        # 統計では (?P<id>...) を {id} と表示する
+        self.routes = [
+            (method, re.compile(pattern), api, handler, method + ' ' + ROUTE_PARAM.sub(r'{\1}', pattern))
+            for method, pattern, api, handler in routes
+        ]
+
+    def stats(self):
+        with self.lock:
+            calls = dict(self.calls)
+            throttled = dict(self.throttled)
+        return {
+            # バッチ内の個々のリクエストは往復数に含めない
+            'total': sum(
+                count for key, count in calls.items()
+                if key != 'POST /token' and not key.endswith('(batched)')
+            ),
+            'calls': calls,
+            'throttled': throttled,
+        }
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.throttled.clear()
+            self.windows.clear()
+
+    def over_quota(self, api):
+        if not self.quota_per_minute:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.setdefault(api, deque())
+            while window and now - window[0] > 60:
+                window.popleft()
+            if len(window) >= self.quota_per_minute:
+                return True
+            window.append(now)
+            return False
+
+    def dispatch(self, method, path, body, headers, inner=False):
+        """(status, headers, body) を返す。"""
+        path = urlsplit(path).path
+        if path == '/batch/drive/v3' and method == 'POST':
+            self.delay()
+            self.count('POST /batch/drive/v3')
+            return self.batch(body, headers)
+
+        for route_method, pattern, api, handler, name in self.routes:
+            match = pattern.fullmatch(path)
+            if route_method != method or match is None:
+                continue
+            if not inner:
+                self.delay()
+            if api not in ('auth', 'slack') and (
+                (self.error_rate and random.random() < self.error_rate) or self.over_quota(api)
+            ):
+                with self.lock:
+                    self.throttled[name] += 1
+                return 429, {'Retry-After': str(self.retry_after)}, THROTTLE_BODY
+            self.count(f"{name} (batched)" if inner else name)
+            params = match.groupdict()
+            # 削除済み・未作成のファイルは Google と同じく 404 を返す（プールのフォールバック確認用）
+            if 'id' in params and params['id'] not in self.files:
+                return 404, {}, NOT_FOUND_BODY
+            payload = json.loads(body) if body and api != 'auth' else {}
+            return handler(payload, **params)
+        return 404, {}, {"error": {"code": 404, "message": f"No fake route for {method} {path}"}}
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] += 1
+
+    def delay(self):
+        if self.latency_ms or self.jitter_ms:
+            time.sleep((self.latency_ms + random.uniform(0, self.jitter_ms)) / 1000)
+
+    def batch(self, body, headers):
+        # googleapiclient の BatchHttpRequest（multipart/mixed）を分解して1件ずつ処理する
+        message = email.message_from_bytes(
+            f"Content-Type: {headers['Content-Type']}\r\n\r\n".encode() + body
+        )
+        boundary = uuid.uuid4().hex
+        parts = []
+        for part in message.get_payload():
+            request_text = part.get_payload()
+            head, _, inner_body = request_text.partition('\r\n\r\n') if '\r\n\r\n' in request_text \
+                else request_text.partition('\n\n')
+            method, inner_path, _ = head.splitlines()[0].split(' ', 2)
+            status, _, response = self.dispatch(method, inner_path, inner_body.encode(), {}, inner=True)
+            # 長いヘッダーは折り返されて届くので空白を詰め直す
+            content_id = ' '.join(part['Content-ID'].split()).strip('<>')
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n\r\n{json.dumps(response)}\r\n"
+            )
+        payload = ''.join(parts) + f"--{boundary}--\r\n"
+        return 200, {'Content-Type': f'multipart/mixed; boundary={boundary}'}, payload
+
+    def token(self, payload):
+        return 200, {}, {"access_token": "fake-token", "expires_in": 3600, "token_type": "Bearer"}
+
+    def create_file(self, payload):
+        file_id = uuid.uuid4().hex
+        with self.lock:
+            self.files[file_id] = {'name': payload.get('name', ''), 'end_index': 2}
+        return 200, {}, {"id": file_id, "name": payload.get('name', ''), "mimeType": payload.get('mimeType')}
+
+    def get_file(self, payload, id):
+        return 200, {}, {"id": id, "name": self.files.get(id, {}).get('name', '')}
+
+    def update_file(self, payload, id):
+        with self.lock:
+            self.files.setdefault(id, {'end_index': 2})['name'] = payload.get('name', '')
+        return 200, {}, {"id": id, "name": payload.get('name', '')}
+
+    def delete_file(self, payload, id):
+        with self.lock:
+            self.files.pop(id, None)
+        return 204, {}, None
+
+    def create_permission(self, payload, id):
+        return 200, {}, {"id": "anyoneWithLink", "type": payload.get('type'), "role": payload.get('role')}
+
+    def get_spreadsheet(self, payload, id):
+        return 200, {}, {
+            "spreadsheetId": id,
+            "properties": {"title": self.files.get(id, {}).get('name', ''), "locale": "ja_JP", "timeZone": "Asia/Tokyo"},
+            "sheets": [{
+                "properties": {
+                    "sheetId": 0,
+                    "title": "Sheet1",
+                    "index": 0,
+                    "sheetType": "GRID",
+                    "gridProperties": {"rowCount": 1000, "columnCount": 26}
+                }
+            }]
+        }
+
+    def spreadsheet_batch_update(self, payload, id):
+        for request in payload.get('requests', []):
+            if 'updateSpreadsheetProperties' in request:
+                self.update_file({'name': request['updateSpreadsheetProperties']['properties'].get('title', '')}, id)
+        return 200, {}, {"spreadsheetId": id, "replies": [{} for _ in payload.get('requests', [])]}
+
+    def values_batch_update(self, payload, id):
+        cells = sum(len(row) for data in payload.get('data', []) for row in data.get('values', []))
+        return 200, {}, {"spreadsheetId": id, "totalUpdatedCells": cells}
+
+    def create_document(self, payload):
+        status, _, created = self.create_file({'name': payload.get('title', '')})
+        return status, {}, {"documentId": created['id'], "title": created['name']}
+
+    def get_document(self, payload, id):
+        end_index = self.files.get(id, {}).get('end_index', 2)
+        return 200, {}, {"documentId": id, "body": {"content": [{"endIndex": 1}, {"endIndex": end_index}]}}
+
+    def document_batch_update(self, payload, id):
+        inserted = sum(
+            utf16_len(request['insertText']['text'])
+            for request in payload.get('requests', []) if 'insertText' in request
+        )
+        with self.lock:
+            self.files.setdefault(id, {'end_index': 2})['end_index'] += inserted
+        return 200, {}, {"documentId": id, "replies": [{} for _ in payload.get('requests', [])]}
+
+    def slack(self, payload):
+        return 200, {'Content-Type': 'text/plain'}, 'ok'
+
+
+def make_handler(fake):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # ヘッダーと本文が別パケットになるため、遅延 ACK で 40ms 待たされないようにする
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def handle_request(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            path = urlsplit(self.path).path
+            if path == '/_stats':
+                status, headers, response = 200, {}, fake.stats()
+            elif path == '/_reset':
+                fake.reset()
+                status, headers, response = 200, {}, {}
+            else:
+                status, headers, response = fake.dispatch(self.command, self.path, body, self.headers)
+
+            if response is None:
+                data = b''
+            elif isinstance(response, str):
+                data = response.encode()
+            else:
+                data = json.dumps(response).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', headers.pop('Content-Type', 'application/json; charset=UTF-8'))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = do_PATCH = do_DELETE = do_PUT = handle_request
+
+    return Handler
+
+
+def start_server(host='127.0.0.1', port=0, **options):
+    """別スレッドでサーバーを起動し (server, fake) を返す。port=0 なら空いているポートを使う。"""
+    fake = FakeGoogle(**options)
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='fake-google', daemon=True).start()
+    return server, fake
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0, help="全呼び出しに加える遅延")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="遅延に加えるランダムな揺らぎの上限")
+    parser.add_argument("--error-rate", type=float, default=0, help="429 を返す確率")
+    parser.add_argument("--quota-per-minute", type=int, default=0, help="API ごとの1分あたりの上限（0 なら無制限）")
+    parser.add_argument("--retry-after", type=int, default=1, help="429 に付ける Retry-After 秒数")
+    args = parser.parse_args()
+
+    server, _ = start_server(
+        args.host, args.port,
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        quota_per_minute=args.quota_per_minute, retry_after=args.retry_after
+    )
+    print(f"fake Google/Slack server on http://{args.host}:{server.server_port}/")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""fake_google.py を相手に main.py の /trigger へ負荷をかけ、レイテンシと API 呼び出し数を計測する。
+
+    python benchmarks/load.py
+    python benchmarks/load.py --concurrency 1 8 32 --rows 100 2000 --sections 10 500 --latency-ms 50
+    python benchmarks/load.py --json bench.json --max-p99-ms 3000 --max-calls-per-request 12
+
+サービスアカウントの鍵は実行ごとに生成するので、Google アカウントは不要（cryptography が必要）。
+閾値を超えると終了コード 1 を返すので、デプロイ前のチェックに使える。
+"""
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_google import start_server  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def service_account_json(token_uri):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    return json.dumps({
+        "type": "service_account",
+        "project_id": "bench",
+        "private_key_id": "bench",
+        "private_key": pem,
+        "client_email": "bench@bench.iam.gserviceaccount.com",
+        "client_id": "0",
+        "token_uri": token_uri,
+    })
+
+
+def start_app(port, fake_root, respect_quota):
+    env = dict(os.environ)
+    env.update({
+        "GOOGLE_CREDENTIALS_JSON": service_account_json(fake_root + "token"),
+        "GOOGLE_API_ROOT": fake_root,
+        "SLACK_WEBHOOK_URL": fake_root + "slack/webhook",
+    })
+    if not respect_quota:
+        # スケジューラの待ちではなくアプリ自体の性能を測る
+        for name in ('SHEETS_READ', 'SHEETS_WRITE', 'DRIVE_READ', 'DRIVE_WRITE', 'DOCS_READ', 'DOCS_WRITE'):
+            env.setdefault(f"RATE_LIMIT_{name}", "1000000")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("uvicorn exited during startup")
+        try:
+            requests.get(url + "/scheduler", timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("uvicorn did not start within 30s")
+
+
+def peak_rss_mb(pid):
+    # Linux のみ。取得できなければ None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def spreadsheet_payload(rows, columns):
+    return {
+        "type": "spreadsheet",
+        "topic": f"bench {uuid.uuid4().hex}",
+        "headers": [f"列{c}" for c in range(columns)],
+        "rows": [[f"値 {r}-{c}" for c in range(columns)] for r in range(rows)],
+    }
+
+
+def document_payload(sections):
+    return {
+        "type": "document",
+        "topic": f"bench {uuid.uuid4().hex}",
+        "contents": [{"heading": f"見出し {i}", "body": f"本文 {i} " * 20} for i in range(sections)],
+    }
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))]
+
+
+def run_scenario(url, fake_root, name, make_payload, concurrency, count, pid):
+    requests.post(fake_root + "_reset")
+    local = threading.local()
+
+    def send(_):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        payload = make_payload()
+        start = time.perf_counter()
+        response = session.post(url + "/trigger", json=payload, timeout=600)
+        return time.perf_counter() - start, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(count)))
+    elapsed = time.perf_counter() - started
+
+    stats = requests.get(fake_root + "_stats").json()
+    latencies = [latency for latency, status in results if status == 200]
+    ok = len(latencies)
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": count,
+        "errors": count - ok,
+        "p50_ms": percentile(latencies, 50) * 1000 if ok else None,
+        "p99_ms": percentile(latencies, 99) * 1000 if ok else None,
+        "rps": ok / elapsed,
+        "calls_per_request": stats["total"] / ok if ok else None,
+        "throttled": sum(stats["throttled"].values()),
+        "peak_rss_mb": peak_rss_mb(pid),
+    }
+
+
+def format_value(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--requests", type=int, default=40, help="シナリオごとのリクエスト数")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 2000])
+    parser.add_argument("--columns", type=int, default=10)
+    parser.add_argument("--sections", type=int, nargs="+", default=[10, 500])
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--quota-per-minute", type=int, default=0)
+    parser.add_argument("--respect-quota", action="store_true", help="スケジューラの既定レート制限を有効にする")
+    parser.add_argument("--json", help="結果を書き出す JSON ファイル")
+    parser.add_argument("--max-p99-ms", type=float)
+    parser.add_argument("--max-calls-per-request", type=float)
+    args = parser.parse_args()
+
+    server, _ = start_server(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        quota_per_minute=args.quota_per_minute, retry_after=1
+    )
+    fake_root = f"http://127.0.0.1:{server.server_port}/"
+    process, url = start_app(free_port(), fake_root, args.respect_quota)
+
+    scenarios = [
+        (f"spreadsheet {rows}x{args.columns}", lambda rows=rows: spreadsheet_payload(rows, args.columns))
+        for rows in args.rows
+    ] + [
+        (f"document {sections} sections", lambda sections=sections: document_payload(sections))
+        for sections in args.sections
+    ]
+
+    results = []
+    try:
+        print(f"{'scenario':<28}{'conc':>5}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>8}{'calls/req':>11}{'429s':>6}{'errors':>8}{'RSS MB':>8}")
+        for name, make_payload in scenarios:
+            for concurrency in args.concurrency:
+                result = run_scenario(url, fake_root, name, make_payload, concurrency, args.requests, process.pid)
+                results.append(result)
+                print(f"{name:<28}{concurrency:>5}{format_value(result['p50_ms'], '.1f'):>10}"
+                      f"{format_value(result['p99_ms'], '.1f'):>10}{result['rps']:>8.1f}"
+                      f"{format_value(result['calls_per_request'], '.2f'):>11}{result['throttled']:>6}"
+                      f"{result['errors']:>8}{format_value(result['peak_rss_mb'], '.1f'):>8}")
+    finally:
+        process.terminate()
+        process.wait()
+        server.shutdown()
+
+    # ru_maxrss は Linux では KB、macOS では bytes
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    peak_mb = peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+    print(f"peak RSS of the app process: {peak_mb:.1f} MB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"results": results, "peak_rss_mb": peak_mb}, f, ensure_ascii=False, indent=2)
+
+    failed = []
+    for result in results:
+        label = f"{result['scenario']} @ {result['concurrency']}"
+        if result['errors']:
+            failed.append(f"{label}: {result['errors']} failed requests")
+        if args.max_p99_ms and (result['p99_ms'] or 0) > args.max_p99_ms:
+            failed.append(f"{label}: p99 {result['p99_ms']:.1f} ms > {args.max_p99_ms} ms")
+        if args.max_calls_per_request and (result['calls_per_request'] or 0) > args.max_calls_per_request:
+            failed.append(f"{label}: {result['calls_per_request']:.2f} calls/request > {args.max_calls_per_request}")
+    for message in failed:
+        print(f"FAIL {message}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""main.py の import（＝ uvicorn が接続を受け付けるまで）の時間を計測する。
+
+    python benchmarks/startup.py                 # 現在の main.py
+    python benchmarks/startup.py --ref baseline  # git の任意リビジョンと比較
+
+旧実装は import 時に認証情報を読むので、GOOGLE_CREDENTIALS_JSON が未設定なら
+使い捨ての鍵を生成して両方の計測に渡す（import 時に通信はしないので Google アカウントは不要）。
+requirements.txt から外したモジュール（gspread_formatting）が入っていなければ
+空のスタブを置くので、旧実装側の計測にはそのモジュールの import 時間が含まれない。
+"""
+import argparse
+import importlib.util
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load import service_account_json  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 旧リビジョンが import していて、現在の依存関係にはないモジュール
+REMOVED_MODULES = ('gspread_formatting',)
+STUB_SOURCE = """def __getattr__(name):
+    return lambda *args, **kwargs: None
+"""
+
+
+def write_stubs(directory):
+    for name in REMOVED_MODULES:
+        if importlib.util.find_spec(name) is None:
+            with open(os.path.join(directory, f"{name}.py"), "w") as f:
+                f.write(STUB_SOURCE)
+
+
+def time_import(directory, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import main"], cwd=directory, check=True)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(label, samples):
+    print(f"{label}: median {statistics.median(samples) * 1000:.1f} ms, "
+          f"min {min(samples) * 1000:.1f} ms, max {max(samples) * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--ref", help="比較対象の git リビジョン")
+    args = parser.parse_args()
+
+    if not os.getenv("GOOGLE_CREDENTIALS_JSON"):
+        os.environ["GOOGLE_CREDENTIALS_JSON"] = service_account_json("https://oauth2.googleapis.com/token")
+
+    report("current", time_import(ROOT, args.repeat))
+
+    if args.ref:
+        source = subprocess.run(
+            ["git", "show", f"{args.ref}:main.py"], cwd=ROOT, check=True, capture_output=True, text=True
+        ).stdout
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "main.py"), "w") as f:
+                f.write(source)
+            write_stubs(directory)
+            report(args.ref, time_import(directory, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
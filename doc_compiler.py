@@ -0,0 +1,131 @@
+import json
+import os
+
+# 1回の insertText に入れる最大長（UTF-16 コード単位）
+MAX_INSERT_UNITS = int(os.getenv("DOCS_MAX_INSERT_UNITS", "100000"))
+# 1回の batchUpdate に入れる最大リクエスト数と最大サイズ（JSON バイト数）
+MAX_BATCH_REQUESTS = int(os.getenv("DOCS_MAX_BATCH_REQUESTS", "500"))
+MAX_BATCH_BYTES = int(os.getenv("DOCS_MAX_BATCH_BYTES", "1000000"))
+
+TITLE_STYLE = 'HEADING_1'
+HEADING_STYLE = 'HEADING_2'
+BODY_STYLE = 'NORMAL_TEXT'
+
+
+def utf16_len(text):
+    # Docs API のインデックスは UTF-16 コード単位（BMP 外の文字は2単位）
+    return len(text.encode('utf-16-le')) // 2
+
+
+def paragraphs(contents, title=None):
+    """(テキスト, 段落スタイル) の列。スタイル None は標準テキストのまま。"""
+    if title is not None:
+        yield title, TITLE_STYLE
+    for content in contents:
+        yield content['heading'], HEADING_STYLE
+        yield content['body'], None
+
+
+def split_runs(parts, limit):
+    runs = []
+    current = []
+    size = 0
+    for text, units in parts:
+        if current and size + units > limit:
+            runs.append(''.join(current))
+            current = []
+            size = 0
+        while units > limit:
+            # 1段落が上限を超える場合は文字単位で分割（サロゲートペアは分割しない）
+            head = text[:limit // 2]
+            runs.append(head)
+            text = text[len(head):]
+            units -= utf16_len(head)
+        current.append(text)
+        size += units
+    if current:
+        runs.append(''.join(current))
+    return runs
+
+
+def compile_document(contents, title=None, start_index=1, append=False, max_insert_units=MAX_INSERT_UNITS):
+    """contents を Docs API の batchUpdate リクエスト列に変換する。
+
+    新規文書は start_index=1 に挿入する。既存文書の末尾に追記する場合は
+    本文の endIndex - 1 を start_index に渡し、append=True にする。
+    """
+    parts = []
+    styles = []
+    cursor = start_index
+    for text, style in paragraphs(contents, title):
+        # 追記時は既存の最終段落の後ろで改行してから続ける
+        text = '\n' + text if append else text + '\n'
+        if style is None and append:
+            # 追記した段落は既存の最終段落（見出しのこともある）のスタイルを引き継ぐので標準に戻す
+            style = BODY_STYLE
+        units = utf16_len(text)
+        if style is not None:
+            # 範囲には段落末尾の改行を含める（空の段落でも範囲が空にならない）
+            start = cursor + 1 if append else cursor
+            end = cursor + units + 1 if append else cursor + units
+            if styles and styles[-1][2] == style and styles[-1][1] >= start:
+                # 同じスタイルの隣接範囲はひとつにまとめる
+                styles[-1][1] = end
+            else:
+                styles.append([start, end, style])
+        parts.append((text, units))
+        cursor += units
+
+    requests_list = []
+    index = start_index
+    for run in split_runs(parts, max_insert_units):
+        requests_list.append({
+            "insertText": {
+                "location": {"index": index},
+                "text": run
+            }
+        })
+        index += utf16_len(run)
+
+    for start, end, style in styles:
+        requests_list.append({
+            "updateParagraphStyle": {
+                "range": {
+                    "startIndex": start,
+                    "endIndex": end
+                },
+                "paragraphStyle": {
+                    "namedStyleType": style
+                },
+                "fields": "namedStyleType"
+            }
+        })
+    return requests_list
+
+
+def split_batches(requests_list, max_requests=MAX_BATCH_REQUESTS, max_bytes=MAX_BATCH_BYTES):
+    """リクエスト列を件数とサイズの上限内の batchUpdate 単位に分ける。順序は保たれる。"""
+    batches = []
+    current = []
+    size = 0
+    for request in requests_list:
+        request_size = len(json.dumps(request, ensure_ascii=False).encode('utf-8'))
+        if current and (len(current) >= max_requests or size + request_size > max_bytes):
+            batches.append(current)
+            current = []
+            size = 0
+        current.append(request)
+        size += request_size
+    if current:
+        batches.append(current)
+    return batches
+
+
+def document_end_index(document):
+    return document['body']['content'][-1]['endIndex']
+
+
+def append_start(document):
+    """既存文書に追記するときの (start_index, append) を返す。空の文書なら通常の挿入になる。"""
+    end_index = document_end_index(document)
+    return end_index - 1, end_index > 2
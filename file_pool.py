@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows では複数プロセスでの共有はできない（1ワーカー前提）
+    fcntl = None
+
+POOL_STATE_DIR = os.getenv("POOL_STATE_DIR", ".")
+POOL_MAX_AGE_SECONDS = int(os.getenv("POOL_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+POOL_CHECK_SECONDS = int(os.getenv("POOL_CHECK_SECONDS", "60"))
+
+
+class FilePool:
+    """作成・共有済みの空ファイルを保持するプール。状態はローカルの JSON ファイルに保存する。
+
+    同じホストの複数ワーカー（uvicorn --workers など）は状態ファイルを flock で排他して共有し、
+    操作のたびに読み直すので、同じファイルを2つのリクエストに渡すことはない。
+    POOL_STATE_DIR を共有しない別ホスト・別コンテナではそれぞれが別のプールを持つ。
+    """
+
+    def __init__(self, name, target, create, discard, low_watermark=None, max_age=POOL_MAX_AGE_SECONDS):
+        self.name = name
+        self.target = target
+        self.low_watermark = target // 2 if low_watermark is None else low_watermark
+        self.max_age = max_age
+        self.create = create
+        self.discard = discard
+        self.path = os.path.join(POOL_STATE_DIR, f"file_pool.{name}.json")
+        self.lock_path = f"{self.path}.lock"
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.entries = self.load() if target > 0 else []
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.evicted = 0
+        self.errors = 0
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    @contextmanager
+    def locked(self):
+        """スレッドとプロセスの両方で排他し、他のワーカーの変更を読み込んでから操作させる。"""
+        with self.lock:
+            # 無効なプール（target == 0）は /pool や /metrics の取得でディスクに触れない
+            if fcntl is None or self.target <= 0:
+                yield
+                return
+            with open(self.lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self.entries = self.load()
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def save(self):
+        # 書き込み途中で落ちても壊れないよう一時ファイル経由で置き換える
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+    def take(self):
+        """プールからファイル ID を1つ取り出す。空なら None。"""
+        with self.locked():
+            # 新しいものから使う。古いものは先頭に残り、補充スレッドが削除する
+            entry = None
+            if self.entries and time.time() - self.entries[-1]['created_at'] <= self.max_age:
+                entry = self.entries.pop()
+                self.hits += 1
+                self.save()
+            else:
+                self.misses += 1
+            if len(self.entries) <= self.low_watermark:
+                self.wakeup.set()
+        return entry['id'] if entry else None
+
+    def evict_stale(self):
+        now = time.time()
+        with self.locked():
+            stale = [entry for entry in self.entries if now - entry['created_at'] > self.max_age]
+            if not stale:
+                return
+            self.entries = [entry for entry in self.entries if now - entry['created_at'] <= self.max_age]
+            self.evicted += len(stale)
+            self.save()
+        for entry in stale:
+            try:
+                self.discard(entry['id'])
+            except Exception as e:
+                print(f"プール({self.name})の古いファイル削除失敗: {e}")
+
+    def refill(self):
+        with self.locked():
+            if len(self.entries) > self.low_watermark:
+                return
+        while True:
+            with self.locked():
+                # 他のワーカーも補充するので、1つ作るたびに残りを数え直す
+                if len(self.entries) >= self.target:
+                    return
+            try:
+                file_id = self.create()
+            except Exception as e:
+                self.errors += 1
+                print(f"プール({self.name})の補充失敗: {e}")
+                return
+            with self.locked():
+                self.entries.append({'id': file_id, 'created_at': time.time()})
+                self.created += 1
+                self.save()
+
+    def run(self):
+        while True:
+            self.wakeup.clear()
+            self.evict_stale()
+            self.refill()
+            self.wakeup.wait(POOL_CHECK_SECONDS)
+
+    def start(self):
+        if self.target > 0:
+            threading.Thread(target=self.run, name=f"file-pool-{self.name}", daemon=True).start()
+
+    def stats(self):
+        with self.locked():
+            return {
+                'size': len(self.entries),
+                'target': self.target,
+                'low_watermark': self.low_watermark,
+                'hits': self.hits,
+                'misses': self.misses,
+                'created': self.created,
+                'evicted': self.evicted,
+                'errors': self.errors,
+            }
@@ -1,14 +1,41 @@
+import contextvars
 import os
 import json
+import re
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
 import gspread
+import httplib2
+from google.auth.transport.requests import Request as GoogleAuthRequest
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 import requests
-from gspread_formatting import format_cell_range, cellFormat, color, textFormat, set_column_width
+from requests.adapters import HTTPAdapter
+from gspread.urls import DRIVE_FILES_API_V3_URL
+from gspread.utils import MimeType, rowcol_to_a1
+from doc_compiler import append_start, compile_document, split_batches
+from file_pool import FilePool
+from metrics import counter, gauge, observe_payload, observe_request, record_call, render, request_scope, server_timing, span
+from result_cache import IdempotencyConflict, ResultCache, create_result_cache, idempotency_key
+from scheduler import is_throttled, scheduler, PRIORITY_HIGH, PRIORITY_LOW
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # プールの補充スレッドは import 時ではなくサーバー起動時に始める
+    start_pools()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 SCOPES = [
     'https://www.googleapis.com/auth/spreadsheets',
@@ -16,141 +43,795 @@ SCOPES = [
     'https://www.googleapis.com/auth/documents'
 ]
 
-credentials_info = json.loads(os.getenv("GOOGLE_CREDENTIALS_JSON"))
-credentials = service_account.Credentials.from_service_account_info(credentials_info, scopes=SCOPES)
-
-gs_client = gspread.authorize(credentials)
-drive_service = build('drive', 'v3', credentials=credentials)
-docs_service = build('docs', 'v1', credentials=credentials)
 slack_webhook_url = os.getenv("SLACK_WEBHOOK_URL")
 
+# レスポンスに Server-Timing ヘッダーを付けるか
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
+# このサイズ（セル数または文字数）を超えるジョブは低優先度でスケジュールする
+LARGE_JOB_SIZE = int(os.getenv("LARGE_JOB_SIZE", "20000"))
+
+# 起動時には何も構築せず、初回利用時にクライアントを作る
+DISCOVERY_CACHE_DIR = os.getenv("DISCOVERY_CACHE_DIR")
+TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+# 負荷試験用: 設定すると Google API への呼び出しをすべてこの URL（例: http://127.0.0.1:8081/）に向ける
+GOOGLE_API_ROOT = os.getenv("GOOGLE_API_ROOT")
+GOOGLE_API_HOSTS = (
+    'https://www.googleapis.com/',
+    'https://sheets.googleapis.com/',
+    'https://docs.googleapis.com/'
+)
+
+clients_lock = threading.Lock()
+token_lock = threading.Lock()
+clients = {}
+service_local = threading.local()
+
+def serialize_refresh(credentials):
+    # バックグラウンド更新・スレッドごとの AuthorizedHttp・gspread のセッションが
+    # 同じ認証情報を共有するので、どこからの更新もこのロックで直列化する
+    refresh = credentials.refresh
+
+    def locked_refresh(request):
+        with token_lock:
+            refresh(request)
+
+    credentials.refresh = locked_refresh
+    return credentials
+
+def refresh_token():
+    clients['credentials'].refresh(GoogleAuthRequest())
+
+def token_refresher():
+    # 期限切れ前にトークンを更新し、リクエスト中の更新待ちをなくす
+    while True:
+        expiry = clients['credentials'].expiry
+        if expiry is not None:
+            wait = (expiry - datetime.utcnow()).total_seconds() - TOKEN_REFRESH_MARGIN_SECONDS
+            if wait > 0:
+                time.sleep(wait)
+        try:
+            refresh_token()
+        except Exception as e:
+            print(f"トークン更新失敗: {e}")
+            time.sleep(30)
+
+def get_credentials():
+    if 'credentials' not in clients:
+        with clients_lock:
+            if 'credentials' not in clients:
+                credentials_info = json.loads(os.getenv("GOOGLE_CREDENTIALS_JSON"))
+                clients['credentials'] = serialize_refresh(
+                    service_account.Credentials.from_service_account_info(credentials_info, scopes=SCOPES)
+                )
+                threading.Thread(target=token_refresher, name="token-refresher", daemon=True).start()
+    return clients['credentials']
+
+# 呼び出し数の計測で、URL のパスからどの API かを決める
+API_PATH_PREFIXES = (
+    ('/v4/spreadsheets', 'sheets'),
+    ('/v1/documents', 'docs'),
+    ('/drive/', 'drive'),
+    ('/upload/drive/', 'drive'),
+    ('/batch/drive/', 'drive'),
+)
+API_ROOT_PATH = urlsplit(GOOGLE_API_ROOT).path.rstrip('/') if GOOGLE_API_ROOT else ''
+# ラベルの種類が増えないよう、パス中のファイル ID は {id} にまとめる
+FILE_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{20,}')
+
+def record_request(method, url, elapsed, status=None, content=b''):
+    """Google API への HTTP リクエスト1回分を記録する。status が None なら応答なし（接続エラーなど）。"""
+    path = urlsplit(url).path
+    if API_ROOT_PATH and path.startswith(API_ROOT_PATH):
+        path = path[len(API_ROOT_PATH):]
+    api = next((name for prefix, name in API_PATH_PREFIXES if path.startswith(prefix)), 'other')
+    if status is None:
+        outcome = 'error'
+    elif is_throttled(status, content.decode('utf-8', 'replace') if status == 403 else ''):
+        outcome = 'throttled'
+    else:
+        outcome = 'ok' if status < 400 else 'error'
+    record_call(api, f"{method.upper()} {FILE_ID_PATTERN.sub('{id}', path)}", elapsed, outcome)
+
+class CountingAdapter(HTTPAdapter):
+    """gspread（requests）が送る HTTP リクエストを1回ずつ記録する。"""
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+        except Exception:
+            record_request(request.method, request.url, time.perf_counter() - start)
+            raise
+        content = response.content if response.status_code == 403 else b''
+        record_request(request.method, request.url, time.perf_counter() - start, response.status_code, content)
+        return response
+
+class CountingHttp(AuthorizedHttp):
+    """googleapiclient の execute(http=...) が送る HTTP リクエストを1回ずつ記録する（バッチは1回）。"""
+
+    def request(self, uri, method='GET', *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            response, content = super().request(uri, method, *args, **kwargs)
+        except Exception:
+            record_request(method, uri, time.perf_counter() - start)
+            raise
+        record_request(method, uri, time.perf_counter() - start, response.status, content)
+        return response, content
+
+class ApiRootAdapter(CountingAdapter):
+    """gspread の固定 URL を GOOGLE_API_ROOT に書き換える。"""
+
+    def send(self, request, **kwargs):
+        for host in GOOGLE_API_HOSTS:
+            if request.url.startswith(host):
+                request.url = GOOGLE_API_ROOT + request.url[len(host):]
+                break
+        return super().send(request, **kwargs)
+
+def get_gs_client():
+    if 'gs_client' not in clients:
+        credentials = get_credentials()
+        with clients_lock:
+            if 'gs_client' not in clients:
+                client = gspread.authorize(credentials)
+                # gspread 6 は http_client.session、5 以前は session に持つ
+                session = getattr(client, 'http_client', client).session
+                session.mount('https://', ApiRootAdapter() if GOOGLE_API_ROOT else CountingAdapter())
+                clients['gs_client'] = client
+    return clients['gs_client']
+
+def get_gs_http_client():
+    # gspread 6 は http_client、5 以前は Client 自身がリクエストを送る
+    client = get_gs_client()
+    return getattr(client, 'http_client', client)
+
+def build_service(api, version, credentials):
+    document = None
+    if DISCOVERY_CACHE_DIR:
+        path = os.path.join(DISCOVERY_CACHE_DIR, f"{api}.{version}.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                document = f.read()
+    if GOOGLE_API_ROOT:
+        document = json.loads(document or get_static_doc(api, version))
+        document['rootUrl'] = GOOGLE_API_ROOT
+    if document is not None:
+        return build_from_document(document, credentials=credentials)
+    return build(api, version, credentials=credentials, cache_discovery=False, static_discovery=True)
+
+def get_service(api, version):
+    key = f"{api}_{version}"
+    if key not in clients:
+        credentials = get_credentials()
+        with clients_lock:
+            if key not in clients:
+                clients[key] = build_service(api, version, credentials)
+    return clients[key]
+
+def get_collection(api, version, name):
+    # documents() などのリソースは生成のたびにメソッドの docstring まで組み立てて重いので
+    # プロセスで1つだけ作る。読み取り専用なのでスレッド間で共有してよい
+    key = f"{api}_{version}_{name}"
+    if key not in clients:
+        service = get_service(api, version)
+        with clients_lock:
+            if key not in clients:
+                clients[key] = getattr(service, name)()
+    return clients[key]
+
+def get_http():
+    # httplib2 はスレッドセーフではないため、execute(http=...) に渡す接続はスレッドごとに持つ
+    http = getattr(service_local, 'http', None)
+    if http is None:
+        http = service_local.http = CountingHttp(get_credentials(), http=httplib2.Http())
+    return http
+
+def get_documents():
+    return get_collection('docs', 'v1', 'documents')
+
+def get_files():
+    return get_collection('drive', 'v3', 'files')
+
+def get_permissions():
+    return get_collection('drive', 'v3', 'permissions')
+
 def set_document_permissions(file_id):
-    drive_service.permissions().create(
+    scheduler.call('drive', 'write', get_permissions().create(
         fileId=file_id,
         body={
             'role': 'writer',
             'type': 'anyone'
         }
-    ).execute()
+    ).execute, http=get_http())
+
+# 1回の values_batch_update で送る最大行数
+SHEET_WRITE_CHUNK_ROWS = int(os.getenv("SHEET_WRITE_CHUNK_ROWS", "1000"))
+
+def sheet_range(worksheet, start_row, start_col, end_row, end_col):
+    title = worksheet.title.replace("'", "''")
+    return f"'{title}'!{rowcol_to_a1(start_row, start_col)}:{rowcol_to_a1(end_row, end_col)}"
 
 def format_headers(worksheet, header_count):
-    header_format = cellFormat(
-        backgroundColor=color(0.9, 0.9, 0.9),
-        textFormat=textFormat(bold=True),
-        horizontalAlignment='CENTER'
+    return {
+        "repeatCell": {
+            "range": {
+                "sheetId": worksheet.id,
+                "startRowIndex": 0,
+                "endRowIndex": 1,
+                "startColumnIndex": 0,
+                "endColumnIndex": header_count
+            },
+            "cell": {
+                "userEnteredFormat": {
+                    "backgroundColor": {"red": 0.9, "green": 0.9, "blue": 0.9},
+                    "textFormat": {"bold": True},
+                    "horizontalAlignment": "CENTER"
+                }
+            },
+            "fields": "userEnteredFormat(backgroundColor,textFormat,horizontalAlignment)"
+        }
+    }
+
+def column_widths(values):
+    # シートを読み直さず、書き込むデータから列幅を計算する
+    widths = []
+    for row in values:
+        for i, cell in enumerate(row):
+            length = len(str(cell))
+            if i == len(widths):
+                widths.append(length)
+            elif length > widths[i]:
+                widths[i] = length
+    return [max(100, min(length * 10, 400)) for length in widths]
+
+def auto_resize_columns(worksheet, values):
+    return [
+        {
+            "updateDimensionProperties": {
+                "range": {
+                    "sheetId": worksheet.id,
+                    "dimension": "COLUMNS",
+                    "startIndex": i,
+                    "endIndex": i + 1
+                },
+                "properties": {"pixelSize": width},
+                "fields": "pixelSize"
+            }
+        }
+        for i, width in enumerate(column_widths(values))
+    ]
+
+def write_worksheet(sheet, worksheet, headers, rows, title=None):
+    values = [headers] + rows
+    col_count = max(len(row) for row in values)
+
+    # グリッドの拡張・ヘッダー書式・列幅をまとめて1回の batch_update で送る
+    format_requests = [{
+        "updateSheetProperties": {
+            "properties": {
+                "sheetId": worksheet.id,
+                "gridProperties": {
+                    "rowCount": max(len(values), worksheet.row_count),
+                    "columnCount": max(col_count, worksheet.col_count)
+                }
+            },
+            "fields": "gridProperties(rowCount,columnCount)"
+        }
+    }]
+    if headers:
+        format_requests.append(format_headers(worksheet, len(headers)))
+    format_requests.extend(auto_resize_columns(worksheet, values))
+    if title is not None:
+        format_requests.append({
+            "updateSpreadsheetProperties": {
+                "properties": {"title": title},
+                "fields": "title"
+            }
+        })
+    with span('format'):
+        scheduler.call('sheets', 'write', sheet.batch_update, {"requests": format_requests})
+
+    with span('write_values'):
+        for start in range(0, len(values), SHEET_WRITE_CHUNK_ROWS):
+            chunk = values[start:start + SHEET_WRITE_CHUNK_ROWS]
+            chunk_cols = max(max(len(row) for row in chunk), 1)
+            scheduler.call('sheets', 'write', sheet.values_batch_update, {
+                "valueInputOption": "RAW",
+                "data": [{
+                    "range": sheet_range(worksheet, start + 1, 1, start + len(chunk), chunk_cols),
+                    "values": chunk
+                }]
+            })
+
+def create_spreadsheet_file(title):
+    # gspread の Client.create は files.create と open_by_key の2リクエストなので、まとめて再試行すると
+    # 2つ目が 429 になっただけで作成済みのファイルが孤立する。作成だけを1回の drive.write として送る
+    response = scheduler.call(
+        'drive', 'write', get_gs_http_client().request, 'post', DRIVE_FILES_API_V3_URL,
+        json={'name': title, 'mimeType': MimeType.google_sheets}, params={'supportsAllDrives': True}
     )
-    format_cell_range(worksheet, f"A1:{chr(64+header_count)}1", header_format)
+    return response.json()['id']
 
-def auto_resize_columns(worksheet):
-    all_values = worksheet.get_all_values()
-    if not all_values:
-        return
-    columns = list(zip(*all_values))
-    for i, col in enumerate(columns):
-        max_length = max(len(str(cell)) for cell in col)
-        width = max(100, min(max_length * 10, 400))
-        set_column_width(worksheet, chr(65+i), width)
+def open_spreadsheet(file_id):
+    # open_by_key は 404/403 を status を持たない例外に変えてしまうので、Spreadsheet を直接作る
+    return scheduler.call('sheets', 'read', gspread.Spreadsheet, get_gs_http_client(), {'id': file_id})
 
-@app.post("/trigger")
-async def trigger(request: Request):
-    data = await request.json()
+# 作成・共有済みの空ファイルのプール（0 なら無効）
+POOL_SPREADSHEETS = int(os.getenv("POOL_SPREADSHEETS", "0"))
+POOL_DOCUMENTS = int(os.getenv("POOL_DOCUMENTS", "0"))
+POOL_FILE_TITLE = "(pool)"
+
+def create_blank_spreadsheet():
+    with scheduler.priority(PRIORITY_LOW):
+        file_id = create_spreadsheet_file(POOL_FILE_TITLE)
+        set_document_permissions(file_id)
+    return file_id
+
+def create_blank_document():
+    with scheduler.priority(PRIORITY_LOW):
+        doc = scheduler.call('docs', 'write', get_documents().create(body={"title": POOL_FILE_TITLE}).execute, http=get_http())
+        set_document_permissions(doc['documentId'])
+    return doc['documentId']
+
+def delete_file(file_id):
+    with scheduler.priority(PRIORITY_LOW):
+        scheduler.call('drive', 'write', get_files().delete(fileId=file_id).execute, http=get_http())
 
-    file_link = ""
+def discard_pooled_file(file_id):
+    # プールから取り出したファイルは書き込み途中で失敗すると中途半端な状態で残るので消す
+    try:
+        delete_file(file_id)
+    except Exception as e:
+        print(f"プールのファイル削除失敗: {e}")
 
+def is_not_found(exc):
+    # gspread.exceptions.APIError は requests.Response を、HttpError は httplib2.Response を持つ
+    response = getattr(exc, 'response', None)
+    if response is not None and hasattr(response, 'status_code'):
+        return response.status_code == 404
+    response = getattr(exc, 'resp', None)
+    return response is not None and response.status == 404
+
+spreadsheet_pool = FilePool('spreadsheet', POOL_SPREADSHEETS, create_blank_spreadsheet, delete_file)
+document_pool = FilePool('document', POOL_DOCUMENTS, create_blank_document, delete_file)
+
+def start_pools():
+    spreadsheet_pool.start()
+    document_pool.start()
+
+def validate_payload(data):
+    if not isinstance(data, dict) or data.get('type') not in ('spreadsheet', 'document'):
+        return "Invalid type. Must be 'spreadsheet' or 'document'."
+    if not isinstance(data.get('topic'), str):
+        return "'topic' is required."
     if data['type'] == 'spreadsheet':
-        sheet = gs_client.create(data['topic'])
-        sheet.share(None, perm_type='anyone', role='writer')
-        worksheet = sheet.get_worksheet(0)
+        if not isinstance(data.get('headers'), list) or not isinstance(data.get('rows'), list):
+            return "'headers' and 'rows' are required for spreadsheet."
+        if not all(isinstance(row, list) for row in data['rows']):
+            return "Each item of 'rows' must be a list."
+    else:
+        if not isinstance(data.get('contents'), list):
+            return "'contents' is required for document."
+        for content in data['contents']:
+            if not isinstance(content, dict) or not isinstance(content.get('heading'), str) \
+                    or not isinstance(content.get('body'), str):
+                return "Each item of 'contents' must have string 'heading' and 'body'."
+    return None
+
+def create_spreadsheet(data, share=True):
+    sheet = None
+    file_id = spreadsheet_pool.take() if share and spreadsheet_pool.target else None
+    if file_id:
+        # プールのファイルは共有済み。名前の変更は書式の batch_update に含める
+        try:
+            with span('open'):
+                sheet = open_spreadsheet(file_id)
+        except Exception as e:
+            if not is_not_found(e):
+                discard_pooled_file(file_id)
+                raise
+            print(f"プールのスプレッドシートが見つからないため新規作成: {file_id}")
+            file_id = None
+    title = data['topic'] if file_id else None
+    if sheet is None:
+        with span('create'):
+            new_id = create_spreadsheet_file(data['topic'])
+        if share:
+            with span('share'):
+                set_document_permissions(new_id)
+        with span('open'):
+            sheet = open_spreadsheet(new_id)
 
-        worksheet.append_row(data['headers'])
-        for row in data['rows']:
-            worksheet.append_row(row)
+    try:
+        with span('open'):
+            worksheet = scheduler.call('sheets', 'read', sheet.get_worksheet, 0)
+        write_worksheet(sheet, worksheet, data['headers'], data['rows'], title=title)
+    except Exception:
+        if file_id:
+            discard_pooled_file(file_id)
+        raise
 
-        format_headers(worksheet, len(data['headers']))
-        auto_resize_columns(worksheet)
+    return sheet.id
 
-        file_link = f"https://docs.google.com/spreadsheets/d/{sheet.id}"
+def write_document(doc_id, contents, title=None, existing=False):
+    start_index, append = 1, False
+    if existing:
+        document = scheduler.call('docs', 'read', get_documents().get(
+            documentId=doc_id,
+            fields='body(content(endIndex))'
+        ).execute, http=get_http())
+        start_index, append = append_start(document)
+
+    with span('compile'):
+        batches = split_batches(compile_document(contents, title=title, start_index=start_index, append=append))
+    with span('write_document'):
+        for batch in batches:
+            scheduler.call('docs', 'write', get_documents().batchUpdate(
+                documentId=doc_id,
+                body={"requests": batch}
+            ).execute, http=get_http())
 
-    elif data['type'] == 'document':
-        doc = docs_service.documents().create(body={"title": data['topic']}).execute()
+def create_document(data, share=True):
+    doc_id = document_pool.take() if share and document_pool.target else None
+    if doc_id:
+        try:
+            with span('rename'):
+                scheduler.call('drive', 'write', get_files().update(
+                    fileId=doc_id,
+                    body={'name': data['topic']}
+                ).execute, http=get_http())
+        except Exception as e:
+            if not is_not_found(e):
+                discard_pooled_file(doc_id)
+                raise
+            print(f"プールのドキュメントが見つからないため新規作成: {doc_id}")
+            doc_id = None
+    pooled = doc_id is not None
+    if not pooled:
+        with span('create'):
+            doc = scheduler.call('docs', 'write', get_documents().create(body={"title": data['topic']}).execute, http=get_http())
         doc_id = doc['documentId']
 
-        set_document_permissions(doc_id)
+        if share:
+            with span('share'):
+                set_document_permissions(doc_id)
 
-        requests_list = []
-        cursor = 1
+    try:
+        write_document(doc_id, data['contents'], title=data['topic'])
+    except Exception:
+        if pooled:
+            discard_pooled_file(doc_id)
+        raise
 
-        # タイトルを本文に挿入 + 見出し1に設定
-        title_text = data['topic'] + "\n"
-        requests_list.append({
-            "insertText": {
-                "location": {"index": cursor},
-                "text": title_text
-            }
-        })
-        requests_list.append({
-            "updateParagraphStyle": {
-                "range": {
-                    "startIndex": cursor,
-                    "endIndex": cursor + len(title_text) - 1
-                },
-                "paragraphStyle": {
-                    "namedStyleType": "HEADING_1"
-                },
-                "fields": "namedStyleType"
-            }
-        })
-        cursor += len(title_text)
+    return doc_id
 
-        for content in data['contents']:
-            heading_text = content['heading'] + "\n"
-            body_text = content['body'] + "\n"
-
-            # 見出し挿入（HEADING_2）
-            requests_list.append({
-                "insertText": {
-                    "location": {"index": cursor},
-                    "text": heading_text
-                }
-            })
-            requests_list.append({
-                "updateParagraphStyle": {
-                    "range": {
-                        "startIndex": cursor,
-                        "endIndex": cursor + len(heading_text) - 1
-                    },
-                    "paragraphStyle": {
-                        "namedStyleType": "HEADING_2"
-                    },
-                    "fields": "namedStyleType"
-                }
-            })
-            cursor += len(heading_text)
+def create_file(data, share=True):
+    if data['type'] == 'spreadsheet':
+        file_id = create_spreadsheet(data, share=share)
+        return file_id, f"https://docs.google.com/spreadsheets/d/{file_id}"
+    file_id = create_document(data, share=share)
+    return file_id, f"https://docs.google.com/document/d/{file_id}"
 
-            # 本文挿入（標準テキスト）
-            requests_list.append({
-                "insertText": {
-                    "location": {"index": cursor},
-                    "text": body_text
+# Drive の HTTP バッチ1回に入れられる最大リクエスト数
+DRIVE_BATCH_SIZE = 100
+
+def share_files(file_ids):
+    """権限付与を BatchHttpRequest にまとめて送る。失敗した分は個別に再試行し、それでも失敗した file_id を返す。"""
+    failed = []
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            failed.append(request_id)
+
+    drive_service = get_service('drive', 'v3')
+    for start in range(0, len(file_ids), DRIVE_BATCH_SIZE):
+        batch = drive_service.new_batch_http_request(callback=callback)
+        chunk = file_ids[start:start + DRIVE_BATCH_SIZE]
+        for file_id in chunk:
+            batch.add(get_permissions().create(
+                fileId=file_id,
+                body={
+                    'role': 'writer',
+                    'type': 'anyone'
                 }
-            })
-            cursor += len(body_text)
+            ), request_id=file_id)
+        scheduler.call('drive', 'write', batch.execute, http=get_http(), cost=len(chunk))
 
-        docs_service.documents().batchUpdate(
-            documentId=doc_id,
-            body={"requests": requests_list}
-        ).execute()
+    unshared = []
+    for file_id in failed:
+        try:
+            set_document_permissions(file_id)
+        except Exception:
+            unshared.append(file_id)
+    return unshared
 
-        file_link = f"https://docs.google.com/document/d/{doc_id}"
+def notify_slack(*file_links):
+    if slack_webhook_url and file_links:
+        message = {"text": "保存が完了しました！\n" + "\n".join(file_links)}
+        start = time.perf_counter()
+        with span('slack'):
+            try:
+                response = requests.post(slack_webhook_url, json=message)
+            except Exception as e:
+                record_call('slack', 'POST', time.perf_counter() - start, 'error')
+                print(f"Slack通知失敗: {e}")
+                return
+            record_call('slack', 'POST', time.perf_counter() - start, 'ok' if response.ok else 'error')
+            if not response.ok:
+                print(f"Slack通知失敗: {response.status_code} {response.text}")
 
+def job_priority(data):
+    # 大きなエクスポートは後回しにして、小さなジョブが待たされないようにする
+    if data['type'] == 'spreadsheet':
+        size = len(data['rows']) * max(len(data['headers']), 1)
     else:
-        return JSONResponse(status_code=400, content={"message": "Invalid type. Must be 'spreadsheet' or 'document'."})
+        size = sum(len(content['heading']) + len(content['body']) for content in data['contents'])
+    return PRIORITY_LOW if size > LARGE_JOB_SIZE else PRIORITY_HIGH
+
+def run_trigger(data):
+    with scheduler.priority(job_priority(data)):
+        _, file_link = create_file(data)
+
+    notify_slack(file_link)
+    return file_link
 
-    if slack_webhook_url:
-        message = {"text": f"保存が完了しました！\n{file_link}"}
+# /trigger/batch の並列実行数と1回あたりの最大件数
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="trigger-batch")
+
+def create_batch_item(data):
+    # 夜間の一括生成が対話的なリクエストを待たせないよう低優先度で流す
+    with scheduler.priority(PRIORITY_LOW):
+        return create_file(data, share=False)
+
+def run_batch(items):
+    # ステージ時間と API 呼び出し数をこのリクエストに集計するため、呼び出し元のコンテキストで実行する
+    futures = [batch_executor.submit(contextvars.copy_context().run, create_batch_item, data) for data in items]
+
+    results = []
+    for index, future in enumerate(futures):
         try:
-            requests.post(slack_webhook_url, json=message)
+            file_id, file_link = future.result()
         except Exception as e:
-            print(f"Slack通知失敗: {e}")
+            results.append({"index": index, "error": str(e)})
+            continue
+        results.append({"index": index, "id": file_id, "link": file_link})
+
+    created = [result for result in results if 'id' in result]
+    file_ids = [result['id'] for result in created]
+    with scheduler.priority(PRIORITY_LOW), span('share'):
+        try:
+            unshared = set(share_files(file_ids))
+        except Exception as e:
+            # 作成済みの結果は返したいので、共有できたか分からないものはすべて失敗扱いにする
+            print(f"共有失敗: {e}")
+            unshared = set(file_ids)
+    for result in created:
+        if result.pop('id') in unshared:
+            result['error'] = "Failed to share file."
+    notify_slack(*(result['link'] for result in created if 'error' not in result))
+
+    return results
+
+result_cache = create_result_cache()
+
+# 非同期ジョブ（?async=true）の実行プールと状態
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "100"))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))
+
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="trigger-job")
+jobs = {}
+# 待機中・実行中のジョブ（キャッシュのキー -> (job_id, 内容のハッシュ)）。リトライを同じジョブにまとめる
+active_jobs = {}
+jobs_lock = threading.Lock()
+
+def prune_jobs():
+    now = time.time()
+    with jobs_lock:
+        for job_id in [k for k, job in jobs.items() if job['finished_at'] and now - job['finished_at'] > JOB_TTL_SECONDS]:
+            del jobs[job_id]
+
+def run_job(job_id, key, fingerprint, data):
+    with jobs_lock:
+        jobs[job_id]['status'] = 'running'
+        jobs[job_id]['started_at'] = time.time()
+    started = time.perf_counter()
+    try:
+        with request_scope() as timings:
+            file_link, cached = result_cache.run(key, fingerprint, run_trigger, data)
+    except Exception as e:
+        observe_request('job', data['type'], 'error', time.perf_counter() - started, timings)
+        with jobs_lock:
+            jobs[job_id].update(status='failed', error=str(e), finished_at=time.time())
+            finish_active_job(key, job_id)
+        return
+    observe_request('job', data['type'], 'cached' if cached else 'ok', time.perf_counter() - started, timings)
+    with jobs_lock:
+        jobs[job_id].update(status='succeeded', link=file_link, cached=cached, finished_at=time.time())
+        finish_active_job(key, job_id)
+
+def finish_active_job(key, job_id):
+    # jobs_lock を持って呼ぶ
+    if active_jobs.get(key, (None,))[0] == job_id:
+        del active_jobs[key]
+
+def create_job(job_type, **fields):
+    """jobs_lock を持って呼ぶ。キューが満杯なら None。"""
+    pending = sum(1 for job in jobs.values() if job['status'] in ('queued', 'running'))
+    if pending >= JOB_QUEUE_LIMIT:
+        return None
+    job_id = uuid.uuid4().hex
+    jobs[job_id] = {
+        'id': job_id,
+        'type': job_type,
+        'status': 'queued',
+        'error': None,
+        'created_at': time.time(),
+        'started_at': None,
+        'finished_at': None,
+        **fields
+    }
+    return job_id
+
+def submit_job(key, fingerprint, data):
+    """job_id を返す。同じキーのジョブが待機中・実行中ならその job_id を返し、キューが満杯なら None。"""
+    prune_jobs()
+    with jobs_lock:
+        if key in active_jobs:
+            job_id, active_fingerprint = active_jobs[key]
+            ResultCache.check(active_fingerprint, fingerprint)
+            return job_id
+        job_id = create_job(data['type'], link=None, cached=False)
+        if job_id is None:
+            return None
+        active_jobs[key] = (job_id, fingerprint)
+    job_executor.submit(run_job, job_id, key, fingerprint, data)
+    return job_id
+
+def run_batch_job(job_id, items):
+    with jobs_lock:
+        jobs[job_id]['status'] = 'running'
+        jobs[job_id]['started_at'] = time.time()
+    started = time.perf_counter()
+    try:
+        with request_scope() as timings:
+            results = run_batch(items)
+    except Exception as e:
+        observe_request('batch_job', 'batch', 'error', time.perf_counter() - started, timings)
+        with jobs_lock:
+            jobs[job_id].update(status='failed', error=str(e), finished_at=time.time())
+        return
+    observe_request('batch_job', 'batch', 'ok', time.perf_counter() - started, timings)
+    with jobs_lock:
+        jobs[job_id].update(status='succeeded', results=results, finished_at=time.time())
+
+def submit_batch_job(items):
+    # 数百件のバッチは HTTP の接続中（Heroku では 30 秒）に終わらないので、結果は /jobs/{job_id} で返す
+    prune_jobs()
+    with jobs_lock:
+        job_id = create_job('batch', results=None)
+    if job_id is not None:
+        job_executor.submit(run_batch_job, job_id, items)
+    return job_id
+
+@app.post("/trigger")
+async def trigger(request: Request):
+    started = time.perf_counter()
+    data = await request.json()
+
+    error = validate_payload(data)
+    if error:
+        observe_request('trigger', 'invalid', 'invalid', time.perf_counter() - started)
+        return JSONResponse(status_code=400, content={"message": error})
+    observe_payload(data, len(await request.body()))
+
+    # リトライで同じファイルを作り直さないよう、同一リクエストは1回だけ実行する
+    key, fingerprint = idempotency_key(data, request.headers.get('Idempotency-Key') or data.get('idempotency_key'))
+
+    if request.query_params.get('async', '').lower() in ('1', 'true'):
+        try:
+            job_id = submit_job(key, fingerprint, data)
+        except IdempotencyConflict as e:
+            return JSONResponse(status_code=422, content={"message": str(e)})
+        if job_id is None:
+            return JSONResponse(status_code=503, content={"message": "Job queue is full."})
+        return JSONResponse(status_code=202, content={"message": "受付完了", "job_id": job_id, "status_url": f"/jobs/{job_id}"})
+
+    with request_scope() as timings:
+        # Google API 呼び出しはブロッキングなのでイベントループ外で実行する
+        try:
+            file_link, cached = await run_in_threadpool(result_cache.run, key, fingerprint, run_trigger, data)
+        except IdempotencyConflict as e:
+            observe_request('trigger', data['type'], 'conflict', time.perf_counter() - started, timings)
+            return JSONResponse(status_code=422, content={"message": str(e)})
+        except Exception:
+            observe_request('trigger', data['type'], 'error', time.perf_counter() - started, timings)
+            raise
+    observe_request('trigger', data['type'], 'cached' if cached else 'ok', time.perf_counter() - started, timings)
+
+    headers = {"Idempotent-Replayed": "true" if cached else "false"}
+    if SERVER_TIMING:
+        headers["Server-Timing"] = server_timing(timings)
+    return JSONResponse(content={"message": "保存完了", "link": file_link}, headers=headers)
+
+@app.post("/trigger/batch")
+async def trigger_batch(request: Request):
+    data = await request.json()
+
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return JSONResponse(status_code=400, content={"message": "'items' must be a non-empty list."})
+    if len(items) > BATCH_MAX_ITEMS:
+        return JSONResponse(status_code=400, content={"message": f"Too many items. Max {BATCH_MAX_ITEMS}."})
+    for index, item in enumerate(items):
+        error = validate_payload(item)
+        if error:
+            return JSONResponse(status_code=400, content={"message": f"items[{index}]: {error}"})
+
+    if request.query_params.get('async', '').lower() in ('1', 'true'):
+        job_id = submit_batch_job(items)
+        if job_id is None:
+            return JSONResponse(status_code=503, content={"message": "Job queue is full."})
+        return JSONResponse(status_code=202, content={"message": "受付完了", "job_id": job_id, "status_url": f"/jobs/{job_id}"})
+
+    started = time.perf_counter()
+    with request_scope() as timings:
+        results = await run_in_threadpool(run_batch, items)
+    observe_request('trigger_batch', 'batch', 'ok', time.perf_counter() - started, timings)
+
+    headers = {"Server-Timing": server_timing(timings)} if SERVER_TIMING else None
+    return JSONResponse(content={"message": "保存完了", "results": results}, headers=headers)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    with jobs_lock:
+        job = jobs.get(job_id)
+        job = dict(job) if job else None
+    if job is None:
+        return JSONResponse(status_code=404, content={"message": "Job not found."})
+
+    if job['started_at']:
+        job['queued_seconds'] = job['started_at'] - job['created_at']
+    if job['finished_at']:
+        job['run_seconds'] = job['finished_at'] - job['started_at']
+    return job
+
+@app.get("/scheduler")
+async def scheduler_stats():
+    return scheduler.stats()
+
+@app.get("/pool")
+async def pool_stats():
+    return {"spreadsheet": spreadsheet_pool.stats(), "document": document_pool.stats()}
+
+@app.get("/metrics")
+async def metrics():
+    scheduler_buckets = scheduler.stats()
+    pools = {"spreadsheet": spreadsheet_pool.stats(), "document": document_pool.stats()}
+    with jobs_lock:
+        job_counts = {}
+        for job in jobs.values():
+            job_counts[job['status']] = job_counts.get(job['status'], 0) + 1
 
-    return {"message": "保存完了", "link": file_link}
+    extra = [
+        gauge('scheduler_queue_depth', 'Calls waiting for a scheduler token.', ('bucket',),
+              [((name,), stats['queue_depth']) for name, stats in scheduler_buckets.items()]),
+        counter('scheduler_throttled_total', 'Throttled (429/rateLimitExceeded) responses per bucket.', ('bucket',),
+              [((name,), stats['throttled']) for name, stats in scheduler_buckets.items()]),
+        gauge('scheduler_rate_per_minute', 'Current adaptive rate per bucket.', ('bucket',),
+              [((name,), stats['rate_per_minute']) for name, stats in scheduler_buckets.items()]),
+        gauge('file_pool_size', 'Blank files ready in the pool.', ('kind',),
+              [((kind,), stats['size']) for kind, stats in pools.items()]),
+        counter('file_pool_hits_total', 'Pool hits.', ('kind',),
+              [((kind,), stats['hits']) for kind, stats in pools.items()]),
+        counter('file_pool_misses_total', 'Pool misses.', ('kind',),
+              [((kind,), stats['misses']) for kind, stats in pools.items()]),
+        gauge('jobs', 'Async jobs by status.', ('status',),
+              [((status,), count) for status, count in sorted(job_counts.items())]),
+    ]
+    return PlainTextResponse(render(extra), media_type="text/plain; version=0.0.4")
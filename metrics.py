@@ -0,0 +1,189 @@
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+# METRICS_ENABLED=0 のときは計測をすべて素通りさせる
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+# 1リクエスト分のステージ時間（Server-Timing 用）
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+
+class Histogram:
+
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, label_values, value):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in sorted(self.series.items()):
+            labels = format_labels(self.labels, label_values)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                le = format_labels(self.labels + ('le',), label_values + (str(bound),))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, label_values, value=1):
+        self.series[label_values] = self.series.get(label_values, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+lock = threading.Lock()
+
+trigger_requests = Counter('trigger_requests_total', 'Trigger requests by endpoint, type and outcome.', ('endpoint', 'type', 'status'))
+trigger_seconds = Histogram('trigger_duration_seconds', 'Trigger latency by endpoint and type.', ('endpoint', 'type'), LATENCY_BUCKETS)
+stage_seconds = Histogram('trigger_stage_seconds', 'Time spent in each trigger stage.', ('stage',), LATENCY_BUCKETS)
+api_calls = Counter('outbound_api_calls_total', 'Outbound HTTP requests by API and method.', ('api', 'method', 'outcome'))
+api_seconds = Histogram('outbound_api_call_seconds', 'Outbound HTTP request latency by API and method.', ('api', 'method'), LATENCY_BUCKETS)
+api_calls_per_request = Histogram('outbound_api_calls_per_request', 'Outbound HTTP requests made by one trigger request.', ('type',), SIZE_BUCKETS)
+payload_size = Histogram('trigger_payload_size', 'Payload size by type and dimension (rows, columns, cells, sections, bytes).', ('type', 'dimension'), SIZE_BUCKETS)
+
+REGISTRY = (trigger_requests, trigger_seconds, stage_seconds, api_calls, api_seconds, api_calls_per_request, payload_size)
+
+
+@contextmanager
+def _span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timings = current_timings.get()
+        # /trigger/batch では同じ timings を複数スレッドが更新するのでロック内で足す
+        with lock:
+            stage_seconds.observe((stage,), elapsed)
+            if timings is not None:
+                timings['stages'][stage] = timings['stages'].get(stage, 0) + elapsed
+
+
+def span(stage):
+    if not METRICS_ENABLED:
+        return nullcontext()
+    return _span(stage)
+
+
+def record_call(api, method, elapsed, outcome):
+    """外部への HTTP リクエスト1回分を記録する。method は 'POST /drive/v3/files' の形。"""
+    if not METRICS_ENABLED:
+        return
+    timings = current_timings.get()
+    with lock:
+        api_calls.inc((api, method, outcome))
+        api_seconds.observe((api, method), elapsed)
+        if timings is not None:
+            timings['calls'] += 1
+
+
+@contextmanager
+def request_scope():
+    """1リクエスト分のステージ時間と API 呼び出し数を集める。"""
+    timings = {'stages': {}, 'calls': 0}
+    token = current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        current_timings.reset(token)
+
+
+def observe_request(endpoint, kind, status, elapsed, timings=None):
+    if not METRICS_ENABLED:
+        return
+    with lock:
+        trigger_requests.inc((endpoint, kind, status))
+        trigger_seconds.observe((endpoint, kind), elapsed)
+        if timings is not None:
+            api_calls_per_request.observe((kind,), timings['calls'])
+
+
+def observe_payload(data, size_bytes):
+    if not METRICS_ENABLED:
+        return
+    kind = data['type']
+    with lock:
+        payload_size.observe((kind, 'bytes'), size_bytes)
+        if kind == 'spreadsheet':
+            columns = len(data['headers'])
+            payload_size.observe((kind, 'rows'), len(data['rows']))
+            payload_size.observe((kind, 'columns'), columns)
+            payload_size.observe((kind, 'cells'), len(data['rows']) * columns)
+        else:
+            payload_size.observe((kind, 'sections'), len(data['contents']))
+
+
+def server_timing(timings):
+    parts = [f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in timings['stages'].items()]
+    parts.append(f"api-calls;desc=\"{timings['calls']}\"")
+    return ', '.join(parts)
+
+
+def snapshot(metric_type, name, help_text, labels, series):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for label_values, value in series:
+        lines.append(f"{name}{format_labels(labels, label_values)} {value}")
+    return lines
+
+
+def gauge(name, help_text, labels, series):
+    return snapshot('gauge', name, help_text, labels, series)
+
+
+def counter(name, help_text, labels, series):
+    # 他のモジュールが数えている累積値をそのまま counter として出す（名前は _total で終える）
+    return snapshot('counter', name, help_text, labels, series)
+
+
+def render(extra=()):
+    lines = []
+    with lock:
+        for metric in REGISTRY:
+            lines.extend(metric.render())
+    for extra_lines in extra:
+        lines.extend(extra_lines)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "memory")
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "result_cache.sqlite3")
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", "86400"))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+# 実行中の同一リクエストを待つ最大時間（これを過ぎたら先行の実行は失敗したとみなす）
+RESULT_CACHE_LEASE_SECONDS = int(os.getenv("RESULT_CACHE_LEASE_SECONDS", "300"))
+POLL_SECONDS = 0.2
+
+KEY_FIELDS = ('type', 'topic', 'headers', 'rows', 'contents')
+
+
+class IdempotencyConflict(Exception):
+    """同じ Idempotency-Key が別の内容のリクエストに使われた。"""
+
+
+def idempotency_key(data, explicit_key=None):
+    """(キャッシュのキー, 内容のハッシュ) を返す。明示的なキーは内容のハッシュと組にして照合する。"""
+    canonical = json.dumps(
+        {field: data.get(field) for field in KEY_FIELDS},
+        sort_keys=True, ensure_ascii=False, separators=(',', ':')
+    )
+    fingerprint = hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+    if explicit_key:
+        return f"key:{explicit_key}", fingerprint
+    return f"sha256:{fingerprint}", fingerprint
+
+
+class MemoryBackend:
+    """プロセス内の dict による TTL+LRU キャッシュ。"""
+
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.results = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """(結果, 内容のハッシュ) を返す。なければ None。"""
+        with self.lock:
+            entry = self.results.get(key)
+            if entry is None:
+                return None
+            value, fingerprint, expires_at = entry
+            if expires_at <= time.time():
+                del self.results[key]
+                return None
+            self.results.move_to_end(key)
+            return value, fingerprint
+
+    def put(self, key, value, fingerprint, ttl):
+        with self.lock:
+            self.results[key] = (value, fingerprint, time.time() + ttl)
+            self.results.move_to_end(key)
+            while len(self.results) > self.max_entries:
+                self.results.popitem(last=False)
+
+    def claim(self, key, fingerprint, lease):
+        """(取れたか, 実行中の内容のハッシュ) を返す。"""
+        now = time.time()
+        with self.lock:
+            pending_until, pending_fingerprint = self.pending.get(key, (0, None))
+            if pending_until > now:
+                return False, pending_fingerprint
+            self.pending[key] = (now + lease, fingerprint)
+            return True, fingerprint
+
+    def release(self, key):
+        with self.lock:
+            self.pending.pop(key, None)
+
+
+class SqliteBackend:
+    """ローカルの SQLite ファイルによる TTL+LRU キャッシュ。同じホストの複数ワーカーで共有できる。"""
+
+    def __init__(self, path=RESULT_CACHE_PATH, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY, value TEXT, fingerprint TEXT, expires_at REAL, used_at REAL, pending_until REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_used_at ON results (used_at)")
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        now = time.time()
+        with self.connect() as conn:
+            row = conn.execute(
+                "SELECT value, fingerprint FROM results WHERE key = ? AND value IS NOT NULL AND expires_at > ?",
+                (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE results SET used_at = ? WHERE key = ?", (now, key))
+            return json.loads(row[0]), row[1]
+
+    def put(self, key, value, fingerprint, ttl):
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, fingerprint, expires_at, used_at, pending_until)"
+                " VALUES (?, ?, ?, ?, ?, NULL)",
+                (key, json.dumps(value, ensure_ascii=False), fingerprint, now + ttl, now)
+            )
+            conn.execute("DELETE FROM results WHERE value IS NOT NULL AND expires_at <= ?", (now,))
+            conn.execute(
+                "DELETE FROM results WHERE key IN ("
+                " SELECT key FROM results WHERE value IS NOT NULL ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def claim(self, key, fingerprint, lease):
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT fingerprint FROM results WHERE key = ? AND"
+                    " ((value IS NOT NULL AND expires_at > ?) OR pending_until > ?)",
+                    (key, now, now)
+                ).fetchone()
+                if row is None:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO results (key, value, fingerprint, expires_at, used_at, pending_until)"
+                        " VALUES (?, NULL, ?, NULL, ?, ?)",
+                        (key, fingerprint, now, now + lease)
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            if row is None:
+                return True, fingerprint
+            return False, row[0]
+
+    def release(self, key):
+        with self.connect() as conn:
+            conn.execute("DELETE FROM results WHERE key = ? AND value IS NULL", (key,))
+
+
+class ResultCache:
+    """同じキーの処理を1回だけ実行し、結果を TTL の間使い回す。"""
+
+    def __init__(self, backend, ttl=RESULT_CACHE_TTL_SECONDS, lease=RESULT_CACHE_LEASE_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self.lease = lease
+        self.events = {}
+        self.lock = threading.Lock()
+
+    def run(self, key, fingerprint, fn, *args):
+        """(結果, キャッシュから返したか) を返す。同じキーで内容が違えば IdempotencyConflict。"""
+        while True:
+            entry = self.backend.get(key)
+            if entry is not None:
+                value, stored_fingerprint = entry
+                self.check(stored_fingerprint, fingerprint)
+                return value, True
+            claimed, holder_fingerprint = self.backend.claim(key, fingerprint, self.lease)
+            if claimed:
+                break
+            self.check(holder_fingerprint, fingerprint)
+            # 他の実行が終わるのを待つ（同一プロセスならイベントで、別ワーカーならポーリングで検知）
+            with self.lock:
+                event = self.events.get(key)
+            if event is not None:
+                event.wait(self.lease)
+            else:
+                time.sleep(POLL_SECONDS)
+
+        with self.lock:
+            event = self.events[key] = threading.Event()
+        try:
+            value = fn(*args)
+            self.backend.put(key, value, fingerprint, self.ttl)
+            return value, False
+        finally:
+            self.backend.release(key)
+            with self.lock:
+                self.events.pop(key, None)
+            event.set()
+
+
+    @staticmethod
+    def check(stored_fingerprint, fingerprint):
+        if stored_fingerprint != fingerprint:
+            raise IdempotencyConflict("Idempotency key was already used for a different request.")
+
+
+def create_result_cache():
+    if RESULT_CACHE_BACKEND == 'sqlite':
+        return ResultCache(SqliteBackend())
+    return ResultCache(MemoryBackend())
@@ -0,0 +1,186 @@
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# 1分あたりのリクエスト数（API ごとのプロジェクト/ユーザー単位クォータの既定値）
+DEFAULT_RATE_LIMITS = {
+    ('sheets', 'read'): 300,
+    ('sheets', 'write'): 60,
+    ('drive', 'read'): 1000,
+    ('drive', 'write'): 300,
+    ('docs', 'read'): 300,
+    ('docs', 'write'): 60,
+}
+
+MAX_RETRIES = int(os.getenv("GOOGLE_MAX_RETRIES", "5"))
+MAX_BACKOFF_SECONDS = 64
+
+# 値が小さいほど優先（小さな対話的ジョブを大きなエクスポートより先に通す）
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+
+THROTTLE_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded', 'RESOURCE_EXHAUSTED')
+
+
+def rate_limit(api, bucket):
+    value = os.getenv(f"RATE_LIMIT_{api.upper()}_{bucket.upper()}")
+    if value:
+        return float(value)
+    return DEFAULT_RATE_LIMITS.get((api, bucket), 60)
+
+
+def is_throttled(status, body):
+    return status == 429 or (status == 403 and any(reason in body for reason in THROTTLE_REASONS))
+
+
+def throttle_delay(exc):
+    """スロットリングによる例外なら待機秒数（Retry-After がなければ 0）を、それ以外は None を返す。"""
+    # gspread.exceptions.APIError は requests.Response を、HttpError は httplib2.Response を持つ
+    response = getattr(exc, 'response', None)
+    if response is not None and hasattr(response, 'status_code'):
+        status = response.status_code
+        headers = response.headers
+        body = response.text
+    else:
+        response = getattr(exc, 'resp', None)
+        if response is None:
+            return None
+        status = response.status
+        headers = response
+        content = getattr(exc, 'content', b'')
+        body = content.decode('utf-8', 'replace') if isinstance(content, bytes) else str(content)
+
+    if not is_throttled(status, body):
+        return None
+
+    retry_after = headers.get('retry-after') or headers.get('Retry-After')
+    try:
+        return max(float(retry_after), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class Bucket:
+    """優先度付きの待ち行列を持つトークンバケット。429 を受けると流量を半減し、成功ごとに少しずつ戻す。"""
+
+    def __init__(self, per_minute):
+        self.max_rate = per_minute / 60
+        self.rate = self.max_rate
+        self.capacity = max(self.max_rate * 10, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.waiters = []
+        self.condition = threading.Condition()
+        self.calls = 0
+        self.throttled = 0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority, seq, cost=1):
+        # バッチ呼び出しは中のリクエスト数だけトークンを使う。容量を超える分は満タンまで待って
+        # 残高をマイナスにし、後続の呼び出しを待たせる
+        with self.condition:
+            need = min(cost, self.capacity)
+            entry = (priority, seq)
+            heapq.heappush(self.waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.refill(now)
+                    if self.waiters[0] == entry and now >= self.blocked_until and self.tokens >= need:
+                        self.tokens -= cost
+                        self.calls += 1
+                        return
+                    if now < self.blocked_until:
+                        timeout = self.blocked_until - now
+                    else:
+                        timeout = max((need - self.tokens) / self.rate, 0.01)
+                    self.condition.wait(timeout)
+            finally:
+                self.waiters.remove(entry)
+                heapq.heapify(self.waiters)
+                self.condition.notify_all()
+
+    def on_throttle(self, delay):
+        with self.condition:
+            self.throttled += 1
+            self.rate = max(self.rate / 2, self.max_rate / 16)
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+            self.tokens = 0
+
+    def on_success(self):
+        with self.condition:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def stats(self):
+        with self.condition:
+            return {
+                'queue_depth': len(self.waiters),
+                'calls': self.calls,
+                'throttled': self.throttled,
+                'rate_per_minute': round(self.rate * 60, 2),
+                'max_rate_per_minute': round(self.max_rate * 60, 2),
+                'blocked_seconds': round(max(self.blocked_until - time.monotonic(), 0), 2),
+            }
+
+
+class Scheduler:
+    """Google API 呼び出しを API/クォータ単位のバケットに通して実行する。"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.sequence = itertools.count()
+
+    def bucket(self, api, bucket):
+        key = (api, bucket)
+        with self.lock:
+            if key not in self.buckets:
+                self.buckets[key] = Bucket(rate_limit(api, bucket))
+            return self.buckets[key]
+
+    @contextmanager
+    def priority(self, value):
+        previous = getattr(self.local, 'priority', PRIORITY_NORMAL)
+        self.local.priority = value
+        try:
+            yield
+        finally:
+            self.local.priority = previous
+
+    def call(self, api, bucket, fn, *args, cost=1, **kwargs):
+        """fn を実行する。cost はクォータ上のリクエスト数（バッチ呼び出しなら中のリクエスト数）。"""
+        target = self.bucket(api, bucket)
+        priority = getattr(self.local, 'priority', PRIORITY_NORMAL)
+        for attempt in range(MAX_RETRIES + 1):
+            target.acquire(priority, next(self.sequence), cost)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                delay = throttle_delay(e)
+                if delay is None or attempt == MAX_RETRIES:
+                    raise
+                if not delay:
+                    delay = min(2 ** attempt + random.random(), MAX_BACKOFF_SECONDS)
+                target.on_throttle(delay)
+                continue
+            target.on_success()
+            return result
+
+    def stats(self):
+        with self.lock:
+            buckets = dict(self.buckets)
+        return {f"{api}.{bucket}": b.stats() for (api, bucket), b in buckets.items()}
+
+
+scheduler = Scheduler()